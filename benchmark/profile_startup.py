@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Local history, git-ignored so a run never dirties the tree. Release builds
+# pass --history pointing at a file persisted outside the checkout.
+DEFAULT_HISTORY = os.path.join(REPO_ROOT, "benchmark", "startup_history.jsonl")
+
+# Function app folder -> (function folders, modules the functions import on first use)
+APPS = {
+    "py-scheduler": ("python/py-scheduler", ["scheduler"],
+                     ["azure.storage.blob", "azure.storage.queue"]),
+    "py-mprocessor": ("python/py-mprocessor", ["mprocessor"],
+                      ["azure.storage.blob", "requests"]),
+    "py-async-scheduler": ("python-async/py-async-scheduler", ["scheduler"],
+                           ["azure.storage.blob.aio", "azure.storage.queue.aio"]),
+    "py-async-mprocessor": ("python-async/py-async-mprocessor", ["mprocessor", "drain"],
+                            ["azure.storage.blob.aio", "azure.storage.queue.aio", "aiohttp"]),
+}
+
+# Run in a fresh interpreter per sample. The worker loads function folders as
+# submodules of an "__app__" package rooted at the app folder, and has already
+# imported azure.functions (and its own dependencies) by then, so both are
+# reproduced here and only the function modules themselves are measured under
+# -X importtime. The deferred modules are imported afterwards to time the cost
+# that now lands on the first invocation instead.
+PROBE = """
+import importlib, importlib.machinery, importlib.util, json, os, sys, time
+import azure.functions
+spec = importlib.machinery.ModuleSpec("__app__", None, is_package=True)
+spec.submodule_search_locations = [os.getcwd()]
+sys.modules["__app__"] = importlib.util.module_from_spec(spec)
+functions, deferred = sys.argv[1].split(","), [m for m in sys.argv[2].split(",") if m]
+sys.stderr.write("import time: probe-start\\n")
+start = time.perf_counter()
+for name in functions:
+    importlib.import_module("__app__." + name)
+load_ms = (time.perf_counter() - start) * 1000
+sys.stderr.write("import time: probe-end\\n")
+start = time.perf_counter()
+for name in deferred:
+    importlib.import_module(name)
+first_use_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"LoadMs": load_ms, "FirstUseMs": first_use_ms}))
+"""
+
+# Parse -X importtime output between the probe markers into
+# {module: cumulative ms}, keeping only modules imported by the function code
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    modules: Dict[str, float] = {}
+    inside = False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        if "probe-start" in line:
+            inside = True
+            continue
+        if "probe-end" in line:
+            break
+        fields = line[len("import time:"):].split("|")
+        if not inside or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        modules[name] = int(fields[1]) / 1000
+    return modules
+
+def profile_app(app_dir: str, functions: List[str], deferred: List[str]) -> Tuple[Dict, Dict[str, float]]:
+    cwd = os.path.join(REPO_ROOT, app_dir)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, ",".join(functions), ",".join(deferred)],
+        cwd=cwd, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {app_dir} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), parse_importtime(completed.stderr)
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--tags", "--always", "--dirty"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def load_previous(history_path: str, python_version: str) -> Optional[Dict]:
+    # Only runs on the same Python version are comparable
+    if not os.path.exists(history_path):
+        return None
+    previous = None
+    with open(history_path) as history:
+        for line in history:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("Python") == python_version:
+                    previous = entry
+    return previous
+
+# Apps whose median load time grew by more than both thresholds since the previous run
+def find_regressions(current: Dict, previous: Optional[Dict], max_pct: float, min_ms: float) -> List[str]:
+    regressions = []
+    if previous is None:
+        return regressions
+    for app, result in current["Apps"].items():
+        before = previous["Apps"].get(app)
+        if before is None:
+            continue
+        delta = result["LoadMsP50"] - before["LoadMsP50"]
+        if delta > min_ms and delta > before["LoadMsP50"] * max_pct / 100:
+            regressions.append(f"{app}: {before['LoadMsP50']:.1f} ms -> {result['LoadMsP50']:.1f} ms "
+                               f"(since {previous['GitRevision']})")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold-start import time profiler for the Python function apps")
+    parser.add_argument("--apps", default=",".join(APPS))
+    parser.add_argument("--runs", type=int, default=7, help="Fresh interpreters per app; medians are reported")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to report per app")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON lines file the run is compared against and appended to")
+    parser.add_argument("--no-record", action="store_true", help="Compare against the history without appending to it")
+    parser.add_argument("--max-regression-pct", type=float, default=20)
+    parser.add_argument("--min-regression-ms", type=float, default=5)
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any app regressed")
+    args = parser.parse_args()
+
+    report = {
+        "GitRevision": git_revision(),
+        "TimestampUtc": datetime.utcnow().isoformat(),
+        "Python": platform.python_version(),
+        "Runs": args.runs,
+        "Apps": {},
+    }
+    for app in [a for a in args.apps.split(",") if a]:
+        app_dir, functions, deferred = APPS[app]
+        load_ms, first_use_ms = [], []
+        module_ms: Dict[str, List[float]] = {}
+        for _ in range(max(1, args.runs)):
+            timings, modules = profile_app(app_dir, functions, deferred)
+            load_ms.append(timings["LoadMs"])
+            first_use_ms.append(timings["FirstUseMs"])
+            for name, elapsed in modules.items():
+                module_ms.setdefault(name, []).append(elapsed)
+
+        top = sorted(((name, statistics.median(values)) for name, values in module_ms.items()),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+        report["Apps"][app] = {
+            "LoadMsP50": round(statistics.median(load_ms), 3),
+            "LoadMsMin": round(min(load_ms), 3),
+            "FirstUseMsP50": round(statistics.median(first_use_ms), 3),
+            "ModuleCount": len(module_ms),
+            "SlowestModulesMs": {name: round(elapsed, 3) for name, elapsed in top},
+        }
+        sys.stderr.write(f"{app}: load {report['Apps'][app]['LoadMsP50']:.1f} ms, "
+                         f"deferred SDK imports {report['Apps'][app]['FirstUseMsP50']:.1f} ms\n")
+
+    previous = load_previous(args.history, report["Python"])
+    regressions = find_regressions(report, previous, args.max_regression_pct, args.min_regression_ms)
+    report["Regressions"] = regressions
+    print(json.dumps(report, indent=2))
+
+    if not args.no_record:
+        with open(args.history, "a") as history:
+            history.write(json.dumps(report) + "\n")
+
+    for regression in regressions:
+        sys.stderr.write(f"Cold-start regression: {regression}\n")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
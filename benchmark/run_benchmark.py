@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import azure.functions as func
+from azure.storage.queue import QueueClient
+from azure.storage.queue.aio import QueueClient as AsyncQueueClient
+
+from stub_server import start_stub_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Well-known Azurite development account
+AZURITE_CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+    "QueueEndpoint=http://127.0.0.1:10001/devstoreaccount1;")
+
+VARIANTS = {
+    "sync": ("python/py-scheduler", "python/py-mprocessor"),
+    "async": ("python-async/py-async-scheduler", "python-async/py-async-mprocessor"),
+}
+
+class FakeTimer:
+    past_due = False
+
+class FakeContext:
+    def __init__(self) -> None:
+        self.invocation_id = str(uuid.uuid4())
+
+# Load a function package from an app folder under a unique module name, so the
+# sync and async apps (which use the same package names) can live side by side.
+def load_function(app_dir: str, package: str, alias: str):
+    package_dir = os.path.join(REPO_ROOT, app_dir, package)
+    spec = importlib.util.spec_from_file_location(
+        alias, os.path.join(package_dir, "__init__.py"), submodule_search_locations=[package_dir])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[alias] = module
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def to_queue_message(message) -> func.QueueMessage:
+    # The Functions host base64-decodes queue messages before invoking the function
+    return func.QueueMessage(id=message.id, body=b64decode(message.content), dequeue_count=message.dequeue_count)
+
+def drain_sync(processor, queue_client: QueueClient, expected: int, batch_size: int, timeout_sec: float) -> List[float]:
+    latencies = []
+    deadline = time.perf_counter() + timeout_sec
+
+    def process(message) -> float:
+        start = time.perf_counter()
+        processor.main(to_queue_message(message), FakeContext())
+        elapsed = time.perf_counter() - start
+        queue_client.delete_message(message)
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=batch_size) as executor:
+        while len(latencies) < expected and time.perf_counter() < deadline:
+            batch = list(queue_client.receive_messages(messages_per_page=min(batch_size, 32), max_messages=batch_size))
+            if not batch:
+                time.sleep(0.1)
+                continue
+            latencies.extend(executor.map(process, batch))
+    return latencies
+
+async def drain_async(processor, queue_client: AsyncQueueClient, expected: int, batch_size: int, timeout_sec: float) -> List[float]:
+    latencies = []
+    deadline = time.perf_counter() + timeout_sec
+
+    async def process(message) -> float:
+        start = time.perf_counter()
+        await processor.main(to_queue_message(message), FakeContext())
+        elapsed = time.perf_counter() - start
+        await queue_client.delete_message(message)
+        return elapsed
+
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        batch = [m async for m in queue_client.receive_messages(messages_per_page=min(batch_size, 32), max_messages=batch_size)]
+        if not batch:
+            await asyncio.sleep(0.1)
+            continue
+        latencies.extend(await asyncio.gather(*[process(m) for m in batch]))
+    return latencies
+
+def run_sync(scheduler, processor, connection_string: str, message_count: int, batch_size: int, timeout_sec: float) -> Dict:
+    queue_client = QueueClient.from_connection_string(connection_string, "checks")
+
+    start = time.perf_counter()
+    scheduler.main(FakeTimer(), FakeContext())
+    dispatch_sec = time.perf_counter() - start
+
+    latencies = drain_sync(processor, queue_client, message_count, batch_size, timeout_sec)
+    drain_sec = time.perf_counter() - start
+
+    processor.ledger_writer.get_ledger_writer().flush()
+    queue_client.close()
+    return {"DispatchSec": dispatch_sec, "DrainSec": drain_sec, "Latencies": latencies}
+
+async def run_async(scheduler, processor, connection_string: str, message_count: int, batch_size: int, timeout_sec: float) -> Dict:
+    async with AsyncQueueClient.from_connection_string(connection_string, "checks") as queue_client:
+        start = time.perf_counter()
+        await scheduler.main(FakeTimer(), FakeContext())
+        dispatch_sec = time.perf_counter() - start
+
+        latencies = await drain_async(processor, queue_client, message_count, batch_size, timeout_sec)
+        drain_sec = time.perf_counter() - start
+
+    # Pooled clients are bound to this run's event loop
+    await processor.ledger_writer.get_ledger_writer().close()
+    await processor.clients.close_clients()
+    return {"DispatchSec": dispatch_sec, "DrainSec": drain_sec, "Latencies": latencies}
+
+def clear_queue(connection_string: str) -> None:
+    queue_client = QueueClient.from_connection_string(connection_string, "checks")
+    try:
+        queue_client.clear_messages()
+    except Exception:
+        pass
+    queue_client.close()
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def parse_ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against Azurite")
+    parser.add_argument("--connection-string", default=os.environ.get("AzureWebJobsStorage", AZURITE_CONNECTION_STRING))
+    parser.add_argument("--variants", default="sync,async")
+    parser.add_argument("--message-counts", type=parse_ints, default=[32, 256])
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 16])
+    parser.add_argument("--batch-sizes", type=parse_ints, default=[1, 16, 32])
+    parser.add_argument("--jobs-per-envelope", type=parse_ints, default=[1])
+    parser.add_argument("--timeout-sec", type=float, default=300)
+    parser.add_argument("--stub-port", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    stub = start_stub_server(args.stub_port)
+    os.environ["AzureWebJobsStorage"] = args.connection_string
+    os.environ["OSProviderUrl"] = f"http://127.0.0.1:{stub.server_port}/metrics.html"
+    os.environ.setdefault("WEBSITE_INSTANCE_ID", f"bench-{platform.node()}")
+
+    results = []
+    for variant in args.variants.split(","):
+        scheduler_dir, processor_dir = VARIANTS[variant]
+        scheduler = load_function(scheduler_dir, "scheduler", f"{variant}_scheduler")
+        processor = load_function(processor_dir, "mprocessor", f"{variant}_mprocessor")
+
+        sweep = itertools.product(args.message_counts, args.concurrency, args.batch_sizes, args.jobs_per_envelope)
+        for message_count, concurrency, batch_size, jobs_per_envelope in sweep:
+            os.environ["MessageCount"] = str(message_count)
+            os.environ["JobsPerEnvelope"] = str(jobs_per_envelope)
+            queue_messages = math.ceil(message_count / max(1, jobs_per_envelope))
+            os.environ["SendConcurrency"] = str(concurrency)
+            os.environ["SendWorkers"] = str(concurrency)
+            clear_queue(args.connection_string)
+
+            stub_requests = stub.RequestHandlerClass.request_count
+            if variant == "async":
+                run = asyncio.run(run_async(scheduler, processor, args.connection_string, queue_messages, batch_size, args.timeout_sec))
+            else:
+                run = run_sync(scheduler, processor, args.connection_string, queue_messages, batch_size, args.timeout_sec)
+
+            latencies = run["Latencies"]
+            result = {
+                "Variant": variant,
+                "MessageCount": message_count,
+                "Concurrency": concurrency,
+                "BatchSize": batch_size,
+                "JobsPerEnvelope": jobs_per_envelope,
+                "QueueMessages": queue_messages,
+                "ProcessedMessages": len(latencies),
+                "DispatchSec": round(run["DispatchSec"], 4),
+                "DrainSec": round(run["DrainSec"], 4),
+                "DispatchPerSec": round(message_count / run["DispatchSec"], 2) if run["DispatchSec"] else 0,
+                "ThroughputPerSec": round(message_count * len(latencies) / queue_messages / run["DrainSec"], 2) if run["DrainSec"] else 0,
+                "LatencyP50Ms": round(percentile(latencies, 50) * 1000, 3),
+                "LatencyP95Ms": round(percentile(latencies, 95) * 1000, 3),
+                "LatencyP99Ms": round(percentile(latencies, 99) * 1000, 3),
+                "MetricsRequests": stub.RequestHandlerClass.request_count - stub_requests,
+            }
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+
+    stub.shutdown()
+    report = {
+        "Timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "GitRevision": git_revision(),
+        "Python": platform.python_version(),
+        "Results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
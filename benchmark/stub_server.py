@@ -0,0 +1,49 @@
+import argparse
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the static website that serves metrics.html. It returns a
+# fixed page with an ETag and honours If-None-Match, like the storage endpoint.
+def build_page(size: int) -> bytes:
+    row = "<tr><td>cpu</td><td>42</td><td>memory</td><td>1024</td></tr>\n"
+    body = row * max(1, size // len(row))
+    return f"<html><body><table>\n{body}</table></body></html>".encode('utf-8')
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    page = build_page(8 * 1024)
+    etag = f'"{hashlib.md5(page).hexdigest()}"'
+    request_count = 0
+
+    def do_GET(self) -> None:
+        type(self).request_count += 1
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(self.page)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+def start_stub_server(port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-stub", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local metrics.html for the benchmark")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), MetricsHandler)
+    print(f"Serving http://127.0.0.1:{args.port}/metrics.html")
+    server.serve_forever()
@@ -0,0 +1,20 @@
+import logging
+import os
+import azure.functions as func
+
+from ..mprocessor.drain import drain
+
+# Drain-mode entry point: every minute, consume the checks queue for
+# DrainDurationSec seconds with explicit batching and concurrency instead of
+# relying on the queue trigger. Only runs with DrainMode=true; disable the
+# queue-triggered function (AzureWebJobs.mprocessor.Disabled=true) so the two
+# do not compete for messages. Timer triggers run on one instance only, so this
+# is a single consumer for the whole app; see readme.md for scaling out.
+async def main(mytimer: func.TimerRequest, context: func.Context) -> None:
+    if os.environ.get("DrainMode", "false").lower() != "true":
+        return
+
+    if mytimer.past_due:
+        logging.info('The timer is past due!')
+
+    await drain(float(os.environ.get("DrainDurationSec", "50")))
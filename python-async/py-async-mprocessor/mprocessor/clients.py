@@ -0,0 +1,82 @@
+import asyncio
+import atexit
+import logging
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+# The SDK and HTTP client modules are imported on first use rather than at
+# module load, so a cold start does not pay for them before the first message
+if TYPE_CHECKING:
+    import aiohttp
+    from azure.storage.blob.aio import BlobServiceClient, ContainerClient
+
+# Clients shared by every invocation in this worker process. They are created
+# on first use and reused so each message does not pay for new TCP/TLS
+# handshakes and client construction. aiohttp sessions are bound to the event
+# loop that created them, so everything is recreated if the loop changes.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_http_session: Optional["aiohttp.ClientSession"] = None
+_blob_service_clients: Dict[str, "BlobServiceClient"] = {}
+_container_clients: Dict[Tuple[str, str], "ContainerClient"] = {}
+
+def _bind_to_running_loop() -> None:
+    global _loop, _http_session
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        # Clients from a previous loop cannot be used (or awaited) here; drop them
+        _loop = loop
+        _http_session = None
+        _blob_service_clients.clear()
+        _container_clients.clear()
+
+def get_http_session() -> "aiohttp.ClientSession":
+    import aiohttp
+
+    global _http_session
+    _bind_to_running_loop()
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(keepalive_timeout=60))
+    return _http_session
+
+def get_blob_service_client(connection_string: str) -> "BlobServiceClient":
+    from azure.storage.blob.aio import BlobServiceClient
+
+    _bind_to_running_loop()
+    client = _blob_service_clients.get(connection_string)
+    if client is None:
+        client = BlobServiceClient.from_connection_string(conn_str=connection_string)
+        _blob_service_clients[connection_string] = client
+    return client
+
+def get_container_client(connection_string: str, container: str) -> "ContainerClient":
+    key = (connection_string, container)
+    client = _container_clients.get(key)
+    if client is None or _loop is not asyncio.get_running_loop():
+        # Container clients share the pipeline (and connection pool) of the service client
+        client = get_blob_service_client(connection_string).get_container_client(container)
+        _container_clients[key] = client
+    return client
+
+async def close_clients() -> None:
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
+    _container_clients.clear()
+    for client in _blob_service_clients.values():
+        try:
+            await client.close()
+        except Exception as ex:
+            logging.warning(f"Error closing blob service client: {ex}")
+    _blob_service_clients.clear()
+
+def _close_at_exit() -> None:
+    # Only possible when the owning loop is idle; otherwise the OS reclaims the sockets
+    if _loop is not None and not _loop.is_closed() and not _loop.is_running():
+        try:
+            _loop.run_until_complete(close_clients())
+        except Exception as ex:
+            logging.warning(f"Error closing shared clients: {ex}")
+
+atexit.register(_close_at_exit)
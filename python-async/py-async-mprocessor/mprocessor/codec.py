@@ -0,0 +1,67 @@
+import json
+
+from base64 import b64encode
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple, Union
+
+# Queue message codec shared by the scheduler and the message processor.
+#
+# Version 1 (legacy) carries one job per message:
+#   {"InsertTimeUtc": ..., "InvocationId": ..., "JobId": 0, "JobName": ...}
+# Version 2 is an envelope that packs many jobs of the same scheduler run into
+# one message, hoisting the shared fields so each extra job costs a few bytes:
+#   {"v":2,"t":"<InsertTimeUtc>","n":"<JobName>","i":"<InvocationId>","j":[0,1,2]}
+# decode() accepts both, so processors keep working with older schedulers.
+
+ENVELOPE_VERSION = 2
+
+# Queue messages are limited to 64 KB of base64 text, i.e. 48 KB of payload
+MAX_ENVELOPE_BYTES = 48 * 1024
+
+_compact = json.JSONEncoder(separators=(',', ':'), default=str)
+
+def encode_job(job_name: str, invocation_id: str, job_id: int) -> str:
+    msgObj = {
+        "InsertTimeUtc": datetime.utcnow(),
+        "JobName": job_name,
+        "InvocationId": invocation_id,
+        "JobId": job_id
+    }
+    return b64encode(json.dumps(msgObj, sort_keys=True, default=str).encode('utf-8')).decode('ascii')
+
+def encode_envelope(job_name: str, invocation_id: str, job_ids: List[int], insert_time: datetime) -> str:
+    envelope = {"v": ENVELOPE_VERSION, "t": insert_time, "n": job_name, "i": invocation_id, "j": job_ids}
+    return b64encode(_compact.encode(envelope).encode('utf-8')).decode('ascii')
+
+# Encode jobs into base64 queue messages, returning (message, job count) pairs.
+# jobs_per_envelope <= 1 produces legacy single-job messages.
+def encode_jobs(job_name: str, invocation_id: str, job_ids: Iterable[int], jobs_per_envelope: int) -> List[Tuple[str, int]]:
+    if jobs_per_envelope <= 1:
+        return [(encode_job(job_name, invocation_id, job_id), 1) for job_id in job_ids]
+
+    insert_time = datetime.utcnow()
+    overhead = len(_compact.encode({"v": ENVELOPE_VERSION, "t": insert_time, "n": job_name, "i": invocation_id, "j": []}).encode('utf-8'))
+    messages = []
+    batch: List[int] = []
+    size = overhead
+    for job_id in job_ids:
+        job_size = len(str(job_id)) + 1
+        if batch and (len(batch) >= jobs_per_envelope or size + job_size > MAX_ENVELOPE_BYTES):
+            messages.append((encode_envelope(job_name, invocation_id, batch, insert_time), len(batch)))
+            batch, size = [], overhead
+        batch.append(job_id)
+        size += job_size
+    if batch:
+        messages.append((encode_envelope(job_name, invocation_id, batch, insert_time), len(batch)))
+    return messages
+
+# Decode a (base64-decoded) queue message body into a list of jobs, each a dict
+# with the legacy InsertTimeUtc/JobName/InvocationId/JobId keys.
+def decode(body: Union[str, bytes]) -> List[Dict]:
+    data = json.loads(body)
+    if data.get("v") == ENVELOPE_VERSION:
+        return [
+            {"InsertTimeUtc": data["t"], "JobName": data["n"], "InvocationId": data["i"], "JobId": job_id}
+            for job_id in data["j"]
+        ]
+    return [data]
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from base64 import b64decode
+from typing import TYPE_CHECKING, Callable, Optional, Set
+
+from . import process_envelope, process_job
+from .codec import decode
+from .instrumentation import maybe_emit_summary, span
+from .ledger_writer import get_ledger_writer
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueMessage
+    from azure.storage.queue.aio import QueueClient
+
+# Queue messages are received in pages of at most 32
+MAX_BATCH_SIZE = 32
+
+class DrainResult:
+    def __init__(self) -> None:
+        self.received = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.poisoned = 0
+        self.renewed = 0
+
+# Long-running consumer for the checks queue. Instead of one function
+# invocation per message, it receives batches of up to 32 messages, runs them
+# through a worker pool of at most `concurrency` messages in flight, keeps slow
+# messages invisible by renewing their visibility timeout, and deletes each
+# message as soon as it completes. Failed messages become visible again and are
+# moved to the poison queue after `max_dequeue_count` attempts, like the
+# queue trigger does.
+class DrainConsumer:
+    def __init__(self, queue_client: "QueueClient", concurrency: int, batch_size: int,
+                 visibility_timeout_sec: int, max_dequeue_count: int) -> None:
+        self.queue_client = queue_client
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.visibility_timeout_sec = visibility_timeout_sec
+        self.max_dequeue_count = max_dequeue_count
+        self.result = DrainResult()
+        self._stopping = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def request_stop(self) -> None:
+        self._stopping.set()
+
+    # Receive and process messages until `duration_sec` elapses or a stop is
+    # requested, then wait up to `grace_sec` for in-flight messages to finish.
+    # Messages still unfinished after that reappear on the queue once their
+    # visibility timeout expires.
+    async def run(self, duration_sec: Optional[float] = None, grace_sec: float = 10) -> DrainResult:
+        deadline = None if duration_sec is None else time.monotonic() + duration_sec
+        poll_interval = 0.1
+
+        while not self._stopping.is_set() and (deadline is None or time.monotonic() < deadline):
+            free = self.concurrency - len(self._tasks)
+            if free <= 0:
+                await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            with span("QueueReceive"):
+                messages = [
+                    message async for message in self.queue_client.receive_messages(
+                        messages_per_page=min(free, self.batch_size),
+                        max_messages=min(free, self.batch_size),
+                        visibility_timeout=self.visibility_timeout_sec)
+                ]
+            if not messages:
+                # Back off like the queue trigger's polling, up to one second
+                await self._wait_for_stop(poll_interval)
+                poll_interval = min(poll_interval * 2, 1.0)
+                continue
+
+            poll_interval = 0.1
+            self.result.received += len(messages)
+            for message in messages:
+                task = asyncio.create_task(self._handle(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+        if self._tasks:
+            done, pending = await asyncio.wait(self._tasks, timeout=grace_sec)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.warning(f"Abandoned {len(pending)} in-flight message(s) at shutdown")
+
+        await get_ledger_writer().flush()
+        return self.result
+
+    async def _wait_for_stop(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _handle(self, message: "QueueMessage") -> None:
+        processed = asyncio.Event()
+        renewer = asyncio.create_task(self._renew_visibility(message, processed))
+        try:
+            succeeded = await self._process(message)
+        finally:
+            # Let an update already sent finish rather than cancelling it, so
+            # the delete below uses the pop receipt it returned
+            processed.set()
+            await renewer
+
+        try:
+            if succeeded:
+                await self.queue_client.delete_message(message.id, message.pop_receipt)
+                self.result.succeeded += 1
+                return
+
+            self.result.failed += 1
+            if message.dequeue_count >= self.max_dequeue_count:
+                await self._move_to_poison_queue(message)
+        except Exception as ex:
+            logging.exception(f"Error completing message {message.id}: {ex}")
+
+    async def _process(self, message: "QueueMessage") -> bool:
+        try:
+            with span("MessageDecode"):
+                jobs = decode(b64decode(message.content))
+
+            connection_string = os.environ["AzureWebJobsStorage"]
+            host_id = os.environ["WEBSITE_INSTANCE_ID"]
+
+            # The message id stands in for the function invocation id in the ledger
+            if len(jobs) == 1:
+                await process_job(jobs[0], message.id, host_id, connection_string)
+                return True
+            failed_jobs = await process_envelope(jobs, message.id, host_id, connection_string)
+            return not failed_jobs
+        except Exception as ex:
+            logging.exception(f"Error processing message {message.id}: {ex}")
+            return False
+
+    # Keep a slow message invisible by extending its visibility timeout at half
+    # its length until `processed` is set. Each update returns a new pop
+    # receipt, needed for the delete.
+    async def _renew_visibility(self, message: "QueueMessage", processed: asyncio.Event) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(processed.wait(), self.visibility_timeout_sec / 2)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                updated = await self.queue_client.update_message(
+                    message.id, message.pop_receipt, visibility_timeout=self.visibility_timeout_sec)
+                message.pop_receipt = updated.pop_receipt
+                self.result.renewed += 1
+            except Exception as ex:
+                logging.warning(f"Could not renew visibility of message {message.id}: {ex}")
+                return
+
+    async def _move_to_poison_queue(self, message: "QueueMessage") -> None:
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.queue.aio import QueueClient
+
+        poison_client = QueueClient.from_connection_string(
+            os.environ["AzureWebJobsStorage"], f"{self.queue_client.queue_name}-poison")
+        async with poison_client:
+            try:
+                await poison_client.create_queue()
+            except ResourceExistsError:
+                pass
+            await poison_client.send_message(message.content)
+        await self.queue_client.delete_message(message.id, message.pop_receipt)
+        self.result.poisoned += 1
+        logging.warning(f"Moved message {message.id} to the poison queue after {message.dequeue_count} attempts")
+
+def create_consumer(queue_client: "QueueClient") -> DrainConsumer:
+    return DrainConsumer(
+        queue_client,
+        int(os.environ.get("DrainConcurrency", "32")),
+        int(os.environ.get("DrainBatchSize", str(MAX_BATCH_SIZE))),
+        int(os.environ.get("DrainVisibilityTimeoutSec", "30")),
+        int(os.environ.get("MaxDequeueCount", "5")))
+
+# Drain the checks queue until `duration_sec` elapses (or forever) and log the results
+async def drain(duration_sec: Optional[float] = None,
+                consumer_ready: Optional[Callable[[DrainConsumer], None]] = None) -> DrainResult:
+    from azure.storage.queue.aio import QueueClient
+
+    async with QueueClient.from_connection_string(os.environ["AzureWebJobsStorage"], "checks") as queue_client:
+        consumer = create_consumer(queue_client)
+        if consumer_ready is not None:
+            consumer_ready(consumer)
+        result = await consumer.run(duration_sec)
+
+    logging.critical(json.dumps({
+        "TriggerType": "DrainConsumer",
+        "ReceivedMessages": result.received,
+        "SucceededMessages": result.succeeded,
+        "FailedMessages": result.failed,
+        "PoisonedMessages": result.poisoned,
+        "VisibilityRenewals": result.renewed,
+    }))
+    maybe_emit_summary("DrainConsumer")
+    return result
+
+# Standalone runner: python -m mprocessor.drain from the function app folder.
+# SIGINT/SIGTERM stop receiving and let in-flight messages finish.
+async def _run_standalone() -> None:
+    loop = asyncio.get_running_loop()
+
+    def install_handlers(consumer: DrainConsumer) -> None:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, consumer.request_stop)
+
+    await drain(consumer_ready=install_handlers)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_standalone())
@@ -0,0 +1,157 @@
+import asyncio
+import atexit
+import logging
+import os
+import time
+import zlib
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from .instrumentation import span
+
+if TYPE_CHECKING:
+    from azure.storage.blob.aio import BlobClient
+
+# Write-behind buffer for the append blob ledger.
+#
+# Instead of one append_block call per processed message, "host:invocation;"
+# records are coalesced per target blob and written as a single block once the
+# buffer for that blob reaches LedgerFlushMaxRecords records, LedgerFlushMaxBytes
+# bytes, or its oldest record is LedgerFlushMaxAgeSec seconds old.
+#
+# Durability: a record is buffered in memory when the invocation returns, so
+# the queue message is already completed before the record is persisted. If
+# the worker process dies, up to one buffer per blob is lost and the scheduler
+# will under-count processed messages for that window. Buffers are flushed by
+# the timer task, by close() (e.g. when the drain consumer stops), and at
+# interpreter exit through the sync SDK. The Functions host can stop a worker
+# without a normal interpreter exit, so under the queue trigger up to
+# LedgerFlushMaxAgeSec of records may still be lost on shutdown.
+# LedgerFlushMaxRecords=1 restores write-through behaviour.
+
+# Name of the ledger blob this host appends to. Hosts are spread over
+# LedgerShardCount shard blobs by crc32(host id), so the setting must match the
+# scheduler's; a single shard keeps the unsharded blob name.
+def ledger_blob_name(job_name: str, host_id: str) -> str:
+    shard_count = int(os.environ.get("LedgerShardCount", "1"))
+    if shard_count <= 1:
+        return job_name
+    return f"{job_name}-{zlib.crc32(host_id.encode('utf-8')) % shard_count}"
+
+class _PendingBlob:
+    def __init__(self, blob_client: "BlobClient") -> None:
+        self.blob_client = blob_client
+        self.records: List[str] = []
+        self.size = 0
+        self.first_added = time.monotonic()
+
+class LedgerWriter:
+    def __init__(self, max_records: int, max_bytes: int, max_age_sec: float, optimistic: bool = True) -> None:
+        self.max_records = max(1, max_records)
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.optimistic = optimistic
+        self._pending: Dict[str, _PendingBlob] = {}
+        self._timer: Optional[asyncio.Task] = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    async def append(self, blob_client: "BlobClient", record: str) -> None:
+        # Buffer updates happen without an await in between, so no lock is needed
+        pending = self._pending.get(blob_client.url)
+        if pending is None:
+            pending = _PendingBlob(blob_client)
+            self._pending[blob_client.url] = pending
+        pending.records.append(record)
+        pending.size += len(record)
+
+        if len(pending.records) >= self.max_records or pending.size >= self.max_bytes:
+            await self._write(self._pending.pop(blob_client.url))
+        elif self._timer is None or self._timer.done():
+            self._stopped = asyncio.Event()
+            self._timer = asyncio.create_task(self._run_timer(self._stopped))
+
+    async def flush(self, max_age_sec: float = 0) -> None:
+        now = time.monotonic()
+        due = [key for key, pending in self._pending.items() if now - pending.first_added >= max_age_sec]
+        ready = [self._pending.pop(key) for key in due]
+        await asyncio.gather(*[self._write(pending) for pending in ready])
+
+    async def close(self) -> None:
+        # Stop the timer between flushes rather than cancelling it, which could
+        # drop buffers it has already taken out of _pending mid-append
+        timer, self._timer = self._timer, None
+        if self._stopped is not None:
+            self._stopped.set()
+        if timer is not None and timer is not asyncio.current_task() and not timer.done():
+            await timer
+        await self.flush()
+
+    async def _run_timer(self, stopped: asyncio.Event) -> None:
+        # Flushes buffers once they reach max_age_sec; exits when nothing is
+        # buffered or the writer is closed
+        interval = max(self.max_age_sec / 2, 0.05)
+        while self._pending:
+            try:
+                await asyncio.wait_for(stopped.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush(self.max_age_sec)
+            except Exception as ex:
+                logging.exception(f"Error flushing ledger buffer: {ex}")
+
+    async def _write(self, pending: _PendingBlob) -> None:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob_client = pending.blob_client
+        if not self.optimistic:
+            with span("BlobExists"):
+                exists = await blob_client.exists()
+            if not exists:
+                logging.info(f"Blob {blob_client.blob_name} does not exist, dropped {len(pending.records)} record(s)")
+                return
+
+        # Optimistic mode appends directly and relies on the not-found error
+        # instead of a pre-check, so a flush costs a single storage call
+        try:
+            with span("BlobAppend"):
+                await blob_client.append_block("".join(pending.records))
+            logging.info(f"Appended {len(pending.records)} record(s) to blob {blob_client.blob_name}")
+        except ResourceNotFoundError:
+            logging.info(f"Blob {blob_client.blob_name} does not exist, dropped {len(pending.records)} record(s)")
+
+    def close_at_exit(self) -> None:
+        # Once atexit handlers run the interpreter has shut down
+        # concurrent.futures, which the aio SDK needs, so no event loop can do
+        # this I/O. The remaining buffers are written with the sync SDK through
+        # new clients built from the same URL and credential.
+        if not self._pending:
+            return
+        from azure.core.exceptions import ResourceNotFoundError
+        from azure.storage.blob import BlobClient as SyncBlobClient
+
+        ready, self._pending = list(self._pending.values()), {}
+        for pending in ready:
+            url = pending.blob_client.url
+            try:
+                with SyncBlobClient.from_blob_url(url, credential=pending.blob_client.credential) as blob_client:
+                    blob_client.append_block("".join(pending.records))
+                logging.info(f"Appended {len(pending.records)} record(s) to blob {blob_client.blob_name} at exit")
+            except ResourceNotFoundError:
+                logging.info(f"Blob {url} does not exist, dropped {len(pending.records)} record(s)")
+            except Exception as ex:
+                logging.warning(f"Error flushing ledger buffer at exit: {ex}")
+
+_writer: Optional[LedgerWriter] = None
+
+def get_ledger_writer() -> LedgerWriter:
+    global _writer
+    if _writer is None:
+        _writer = LedgerWriter(
+            int(os.environ.get("LedgerFlushMaxRecords", "32")),
+            int(os.environ.get("LedgerFlushMaxBytes", str(64 * 1024))),
+            float(os.environ.get("LedgerFlushMaxAgeSec", "1")),
+            os.environ.get("OptimisticStorageOps", "true").lower() == "true")
+        atexit.register(_writer.close_at_exit)
+    return _writer
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import time
+
+from typing import Dict, Optional
+
+from .clients import get_http_session
+
+DEFAULT_OS_PROVIDER_URL = "https://veshivanpyasyncfunca636.z13.web.core.windows.net/metrics.html"
+
+class _CacheEntry:
+    def __init__(self, text: str, etag: Optional[str], last_modified: Optional[str], ttl_sec: float) -> None:
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = time.monotonic() + ttl_sec
+
+# Caches the OS metrics page for MetricsCacheTtlSec seconds. Once stale it is
+# revalidated with If-None-Match/If-Modified-Since, so an unchanged page costs
+# a 304 instead of a full download. Concurrent invocations that miss the cache
+# await the same in-flight request instead of each issuing their own.
+class MetricsProvider:
+    def __init__(self, url: str, ttl_sec: float) -> None:
+        self.url = url
+        self.ttl_sec = ttl_sec
+        self._entry: Optional[_CacheEntry] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._stats = {"Hits": 0, "Misses": 0, "Revalidated": 0, "Coalesced": 0}
+
+    async def get(self) -> str:
+        entry = self._entry
+        if entry is not None and time.monotonic() < entry.expires_at:
+            self._stats["Hits"] += 1
+            return entry.text
+
+        if self._inflight is None or self._inflight.get_loop() is not asyncio.get_running_loop():
+            self._stats["Misses"] += 1
+            self._inflight = asyncio.ensure_future(self._fetch(entry))
+        else:
+            self._stats["Coalesced"] += 1
+
+        # Shield the shared fetch so a cancelled invocation does not cancel it for the others
+        entry = await asyncio.shield(self._inflight)
+        return entry.text
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    async def _fetch(self, entry: Optional[_CacheEntry]) -> _CacheEntry:
+        try:
+            headers = {}
+            if entry is not None:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+            async with get_http_session().get(self.url, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    self._stats["Revalidated"] += 1
+                    entry.expires_at = time.monotonic() + self.ttl_sec
+                    return entry
+
+                response.raise_for_status()
+                entry = _CacheEntry(
+                    await response.text(),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    self.ttl_sec)
+            self._entry = entry
+            return entry
+        finally:
+            self._inflight = None
+
+_provider: Optional[MetricsProvider] = None
+
+def get_metrics_provider() -> MetricsProvider:
+    global _provider
+    if _provider is None:
+        _provider = MetricsProvider(
+            os.environ.get("OSProviderUrl", DEFAULT_OS_PROVIDER_URL),
+            float(os.environ.get("MetricsCacheTtlSec", "5")))
+    return _provider
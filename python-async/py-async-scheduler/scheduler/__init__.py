@@ -1,67 +1,150 @@
+import asyncio
 import logging
 import os
+import time
 import azure.functions as func
 import json
 
-from base64 import b64encode
 from datetime import datetime
-from azure.storage.blob.aio import BlobServiceClient
-from azure.storage.queue.aio import QueueClient
-from azure.core.exceptions import ResourceExistsError
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-# Setup the append blob
-async def setup_append_blob(connection_string: str, append_blob_name: str, start_time: datetime) -> None:
-    
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    container_client = blob_service_client.get_container_client("checks")
+from .codec import encode_jobs
+from .dispatch import send_messages
+from .instrumentation import maybe_emit_summary, span
+from .ledger import LEDGER_CHUNK_SIZE, is_window_blob, read_ledger, shard_blob_names
+
+# The Azure SDK is imported on first use rather than at module load, so a cold
+# start does not pay for it before the first invocation needs it
+if TYPE_CHECKING:
+    from azure.storage.blob.aio import BlobClient, ContainerClient, StorageStreamDownloader
+
+# Resources known to exist, so later ticks in this worker process can skip the
+# create calls. With OptimisticStorageOps=false every tick pre-checks as before.
+_provisioned = set()
+
+def optimistic_storage_ops() -> bool:
+    return os.environ.get("OptimisticStorageOps", "true").lower() == "true"
+
+async def ensure_container(container_client: "ContainerClient", optimistic: bool) -> None:
+    from azure.core.exceptions import ResourceExistsError
 
+    key = f"{container_client.account_name}/containers/{container_client.container_name}"
+    if optimistic and key in _provisioned:
+        return
     try:
         await container_client.create_container()
     except ResourceExistsError:
         logging.info('Container exist.')
+    _provisioned.add(key)
+
+# Log the merged stats of a ledger window from the properties and streamed
+# content of its shard blobs, which are parsed in parallel
+async def process_append_blob(append_blob_name: str, shards: List["StorageStreamDownloader"]) -> None:
+    blob_stats = {
+        "AppendBlobName": append_blob_name,
+        "ShardCount": len(shards),
+        "BlockCount": sum(shard.properties.append_blob_committed_block_count or 0 for shard in shards),
+    }
 
-    append_blob_client = container_client.get_blob_client(append_blob_name)
-    if (await append_blob_client.exists()):
-        blob_properties = await append_blob_client.get_blob_properties()
-        
-        blob_stats = {
-            "AppendBlobName": append_blob_name,
-            "BlockCount": blob_properties.append_blob_committed_block_count,
-        }
+    try:
+        shard_properties = [shard.properties for shard in shards]
+        blob_stats["LastSchedulerStartTime"] = shard_properties[0].metadata["TriggerData"]
+        blob_stats["BlobLastModifiedTime"] = f"{max(p.last_modified for p in shard_properties)}"
+        blob_stats["BlobCreationTime"] = f"{min(p.creation_time for p in shard_properties)}"
+
+        approximate = os.environ.get("LedgerApproximateCounts", "false").lower() == "true"
+        shard_stats = await asyncio.gather(*[read_ledger(shard, approximate) for shard in shards])
+        ledger_stats = shard_stats[0]
+        for stats in shard_stats[1:]:
+            ledger_stats.merge(stats)
+
+        blob_stats["ProcessedMessageCount"] = ledger_stats.invocation_count
+        blob_stats["HostCount"] = ledger_stats.host_count
+        blob_stats["HostMessageCounts"] = ledger_stats.host_counts
+        blob_stats["MalformedRecordCount"] = ledger_stats.malformed_records
+        blob_stats["ApproximateCounts"] = approximate
+
+        logging.critical(json.dumps(blob_stats))
+    except Exception as ex:
+        logging.exception(f"Exception while processing append blob: {ex}")
 
-        try:
-            blob_stats["LastSchedulerStartTime"] = blob_properties.metadata["TriggerData"]
-            blob_stats["BlobLastModifiedTime"] = f"{blob_properties.last_modified}"
-            blob_stats["BlobCreationTime"] = f"{blob_properties.creation_time}"
-            
-            blob_stream = await append_blob_client.download_blob()
-            blob_content = await blob_stream.content_as_text()
-            host_ids = set()
-            invocation_ids = set()
-
-            if (blob_content is not None) and len(blob_content) > 0:
-                for entry in blob_content.split(';'):
-                    if entry.find(':') > 0:
-                        key, value = entry.split(':')
-                        host_ids.add(key)
-                        invocation_ids.add(value)
-
-            blob_stats["ProcessedMessageCount"] = len(invocation_ids)
-            blob_stats["HostCount"] = len(host_ids)
-
-            logging.critical(json.dumps(blob_stats))
-
-            await append_blob_client.delete_blob()
-        except Exception as ex:
-            logging.exception(f"Exception while processing append blob: {ex}")
-
-    metadata = {
-        "TriggerData": start_time.strftime("%Y-%m-%d %H:%M:%S%z")
-    }
-    await append_blob_client.create_append_blob(metadata=metadata)
+# Start downloading one shard found by listing the window. The download
+# response carries the properties and metadata, so no exists() call is needed;
+# a shard deleted since the listing is skipped
+async def download_shard(blob_client: "BlobClient") -> Optional["StorageStreamDownloader"]:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        return await blob_client.download_blob()
+    except ResourceNotFoundError:
+        return None
+
+async def create_shard(container_client: "ContainerClient", blob_client: "BlobClient", metadata: Dict[str, str]) -> None:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        await blob_client.create_append_blob(metadata=metadata)
+    except ResourceNotFoundError:
+        # The container was removed since it was provisioned; create it and retry
+        _provisioned.clear()
+        await ensure_container(container_client, False)
+        await blob_client.create_append_blob(metadata=metadata)
+
+async def delete_shard(container_client: "ContainerClient", name: str) -> None:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        await container_client.delete_blob(name)
+    except ResourceNotFoundError:
+        pass
+
+# Setup the append blob
+async def setup_append_blob(connection_string: str, append_blob_name: str, start_time: datetime) -> None:
+    from azure.storage.blob.aio import BlobServiceClient
+
+    # Download the ledger in bounded ranges so it is never held in memory as a
+    # whole. The client (and its aiohttp session) is closed at the end of the tick.
+    async with BlobServiceClient.from_connection_string(
+            connection_string,
+            max_single_get_size=LEDGER_CHUNK_SIZE,
+            max_chunk_get_size=LEDGER_CHUNK_SIZE) as blob_service_client:
+        container_client = blob_service_client.get_container_client("checks")
+
+        optimistic = optimistic_storage_ops()
+        await ensure_container(container_client, optimistic)
+
+        # Discover the blobs actually written for this window with one listing,
+        # whatever the shard count was when they were created. Shards outside the
+        # current layout (e.g. after LedgerShardCount changed) are still merged
+        # below and then deleted.
+        shard_names = shard_blob_names(append_blob_name, int(os.environ.get("LedgerShardCount", "1")))
+        existing_names = [
+            blob.name async for blob in container_client.list_blobs(name_starts_with=append_blob_name)
+            if is_window_blob(append_blob_name, blob.name)
+        ]
+
+        downloads = await asyncio.gather(*[
+            download_shard(container_client.get_blob_client(name)) for name in existing_names])
+        shards = [shard for shard in downloads if shard is not None]
+        if shards:
+            await process_append_blob(append_blob_name, shards)
+        else:
+            logging.info(f"Blob {append_blob_name} does not exist.")
+
+        # Creating an append blob replaces any existing blob of the same name, so the
+        # optimistic path only deletes shards that are not created again
+        stale_names = [shard.name for shard in shards if not optimistic or shard.name not in shard_names]
+        await asyncio.gather(*[delete_shard(container_client, name) for name in stale_names])
+
+        metadata = {
+            "TriggerData": start_time.strftime("%Y-%m-%d %H:%M:%S%z")
+        }
+        await asyncio.gather(*[
+            create_shard(container_client, container_client.get_blob_client(name), metadata) for name in shard_names])
 
 async def main(mytimer: func.TimerRequest, context: func.Context) -> None:
     start_time = datetime.utcnow()
+    start_counter = time.perf_counter()
     if mytimer.past_due:
         logging.info('The timer is past due!')
 
@@ -73,45 +156,62 @@ async def main(mytimer: func.TimerRequest, context: func.Context) -> None:
         "Status": "Succeeded"
     }
     iMsg = 0
+    iFailed = 0
 
     try:
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.queue.aio import QueueClient
+
         # Create a queue client using connection string
         connection_string = os.environ["AzureWebJobsStorage"]
 
         # Setup the append blob
         blob_name = f"ApendBlob_{int(start_time.second / 20)}"
-        await setup_append_blob(connection_string, blob_name, start_time)
-
-        queue_client = QueueClient.from_connection_string(connection_string, "checks")
-                
-        try:
-            # Create the queue
-            await queue_client.create_queue()
-        except ResourceExistsError:
-            logging.info('Queue exist.')
+        with span("LedgerSetup"):
+            await setup_append_blob(connection_string, blob_name, start_time)
 
-        # Send messages to the queue
+        # Encode all messages up front so the send pipeline only does I/O
         max_messages = int(os.environ["MessageCount"])
-        # task_list = []
-        for i in range(max_messages):
-            msgObj = {
-                "InsertTimeUtc": datetime.utcnow(),
-                "JobName": blob_name,
-                "InvocationId": context.invocation_id,
-                "JobId": i
-            }
-            message = b64encode(json.dumps(msgObj, sort_keys=True, default=str).encode('utf-8')).decode('ascii')
-            await queue_client.send_message(message)
-            iMsg += 1
-        # Wait for all the tasks to complete
-        # await asyncio.gather(*task_list)
-            
+        with span("MessageEncode"):
+            # JobsPerEnvelope > 1 packs several jobs into each queue message
+            jobs_per_envelope = int(os.environ.get("JobsPerEnvelope", "1"))
+            messages = encode_jobs(blob_name, context.invocation_id, range(max_messages), jobs_per_envelope)
+
+        # Send messages to the queue with a bounded number of sends in flight
+        concurrency = int(os.environ.get("SendConcurrency", "16"))
+        max_retries = int(os.environ.get("SendMaxRetries", "3"))
+        backoff_sec = float(os.environ.get("SendRetryBackoffSec", "0.5"))
+
+        # SDK retries are disabled so SendMaxRetries/SendRetryBackoffSec are the only
+        # retry policy for sends, and every retry is counted in RetriedSends. The
+        # client (and its aiohttp session) is closed at the end of the tick.
+        async with QueueClient.from_connection_string(connection_string, "checks", retry_total=0) as queue_client:
+            queue_key = f"{queue_client.account_name}/queues/{queue_client.queue_name}"
+            if not optimistic_storage_ops() or queue_key not in _provisioned:
+                try:
+                    # Create the queue
+                    await queue_client.create_queue()
+                except ResourceExistsError:
+                    logging.info('Queue exist.')
+                _provisioned.add(queue_key)
+
+            result = await send_messages(queue_client, messages, concurrency, max_retries, backoff_sec)
+
+        iMsg = result.succeeded_jobs
+        iFailed = result.failed_jobs
+        status["QueueMessages"] = f"{result.succeeded}"
+        status["RetriedSends"] = f"{result.retried}"
+        if iFailed > 0:
+            status["Status"] = "Failed"
+            # The queue may have been removed; provision it again on the next tick
+            _provisioned.discard(queue_key)
     except Exception as ex:
         logging.exception(f"Error sending message to queue: {ex}")
         status["Status"] = "Failed"
     finally:
-        end_time = datetime.utcnow()
-        status["EndTime"] = end_time.strftime("%Y-%m-%d %H:%M:%S%z")
-        status["DurationInSec"] = f"{(end_time - start_time).total_seconds()}"
+        status["EndTime"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S%z")
+        status["DurationInSec"] = f"{time.perf_counter() - start_counter}"
         status["ScheduledMessages"] = f"{iMsg}"
-        logging.critical(json.dumps(status))
\ No newline at end of file
+        status["FailedMessages"] = f"{iFailed}"
+        logging.critical(json.dumps(status))
+        maybe_emit_summary("Scheduler")
\ No newline at end of file
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import random
+
+from typing import TYPE_CHECKING, Iterable, Tuple
+
+from .instrumentation import span
+
+if TYPE_CHECKING:
+    from azure.storage.queue.aio import QueueClient
+
+# Status codes the queue service uses when it is throttling or briefly unavailable
+RETRYABLE_STATUS_CODES = {408, 429, 500, 503}
+
+# Messages may carry several jobs, so jobs are counted separately from queue messages
+class DispatchResult:
+    def __init__(self) -> None:
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.succeeded_jobs = 0
+        self.failed_jobs = 0
+
+# Recreates the queue for the sends of one tick when they find it missing,
+# e.g. because it was deleted after being cached as provisioned. Only the first
+# sender to see the 404 creates it; the others wait and then retry.
+class QueueRecreator:
+    def __init__(self, queue_client: "QueueClient") -> None:
+        self.queue_client = queue_client
+        self._lock = asyncio.Lock()
+        self._recreated = False
+
+    async def recreate(self) -> None:
+        from azure.core.exceptions import ResourceExistsError
+
+        async with self._lock:
+            if self._recreated:
+                return
+            self._recreated = True
+            try:
+                await self.queue_client.create_queue()
+                logging.warning(f"Queue {self.queue_client.queue_name} was missing and has been recreated")
+            except ResourceExistsError:
+                pass
+            except Exception as ex:
+                logging.warning(f"Could not recreate queue {self.queue_client.queue_name}: {ex}")
+
+def is_retryable(ex: Exception) -> bool:
+    from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+    if isinstance(ex, (ServiceRequestError, ServiceResponseError)):
+        return True
+    return isinstance(ex, HttpResponseError) and ex.status_code in RETRYABLE_STATUS_CODES
+
+# Send one message, backing off exponentially (with jitter) on throttling. A
+# missing queue is recreated once and the send retried straight away.
+async def send_with_retry(queue_client: "QueueClient", message: str, job_count: int, max_retries: int,
+                          backoff_sec: float, result: DispatchResult, recreator: QueueRecreator) -> None:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    attempt = 0
+    recreated = False
+    while True:
+        try:
+            with span("QueueSend"):
+                await queue_client.send_message(message)
+            result.succeeded += 1
+            result.succeeded_jobs += job_count
+            return
+        except Exception as ex:
+            if isinstance(ex, ResourceNotFoundError) and not recreated:
+                recreated = True
+                await recreator.recreate()
+                continue
+            if attempt >= max_retries or not is_retryable(ex):
+                logging.warning(f"Failed to send message after {attempt + 1} attempt(s): {ex}")
+                result.failed += 1
+                result.failed_jobs += job_count
+                return
+            delay = backoff_sec * (2 ** attempt)
+            attempt += 1
+            result.retried += 1
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+# Send all (message, job count) pairs with at most `concurrency` sends in flight. A fixed set of
+# workers pull from a shared iterator, so only `concurrency` tasks ever exist
+# regardless of the number of messages.
+async def send_messages(queue_client: "QueueClient", messages: Iterable[Tuple[str, int]], concurrency: int,
+                        max_retries: int, backoff_sec: float) -> DispatchResult:
+    result = DispatchResult()
+    recreator = QueueRecreator(queue_client)
+    pending = iter(messages)
+
+    async def worker() -> None:
+        for message, job_count in pending:
+            await send_with_retry(queue_client, message, job_count, max_retries, backoff_sec, result, recreator)
+
+    await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    return result
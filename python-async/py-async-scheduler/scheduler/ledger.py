@@ -0,0 +1,120 @@
+import codecs
+import hashlib
+import math
+
+from typing import TYPE_CHECKING, Dict, List, Set
+
+if TYPE_CHECKING:
+    from azure.storage.blob.aio import StorageStreamDownloader
+
+# Size of each ranged download while reading an append blob ledger
+LEDGER_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Names of the shard blobs of a ledger window. Processors pick a shard by
+# crc32(host id) % LedgerShardCount, so both apps must use the same setting;
+# a single shard keeps the unsharded blob name.
+def shard_blob_names(append_blob_name: str, shard_count: int) -> List[str]:
+    if shard_count <= 1:
+        return [append_blob_name]
+    return [f"{append_blob_name}-{shard}" for shard in range(shard_count)]
+
+# Whether blob_name belongs to the window of append_blob_name under any shard
+# count, i.e. is the unsharded blob itself or one of its "-<n>" shards
+def is_window_blob(append_blob_name: str, blob_name: str) -> bool:
+    suffix = blob_name[len(append_blob_name):]
+    return blob_name.startswith(append_blob_name) and (suffix == "" or (suffix[:1] == "-" and suffix[1:].isdigit()))
+
+# HyperLogLog cardinality estimator, used when the ledger is too large to keep
+# every invocation id in memory. 2^12 registers give ~1.6% standard error in 4 KB.
+class HyperLogLog:
+    def __init__(self, precision: int = 12) -> None:
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value: str) -> None:
+        hashed = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros > 0:
+            # Small range correction (linear counting)
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog") -> None:
+        for index, rank in enumerate(other.registers):
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+
+# Incremental parser for "host:invocation;" ledger records. Text is fed in
+# arbitrary chunks; a record split across two chunks is carried over, so only
+# the unique ids (or a fixed size sketch in approximate mode) are kept in memory.
+class LedgerStats:
+    def __init__(self, approximate: bool = False) -> None:
+        self.approximate = approximate
+        self.host_counts: Dict[str, int] = {}
+        self.malformed_records = 0
+        self._invocation_ids: Set[str] = set()
+        self._invocation_sketch = HyperLogLog()
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._carry = ''
+
+    def feed(self, data: bytes) -> None:
+        text = self._carry + self._decoder.decode(data)
+        records = text.split(';')
+        self._carry = records.pop()
+        for record in records:
+            self._add_record(record)
+
+    def finish(self) -> None:
+        text = self._carry + self._decoder.decode(b'', final=True)
+        self._carry = ''
+        self._add_record(text)
+
+    def _add_record(self, record: str) -> None:
+        if not record:
+            return
+        parts = record.split(':')
+        if len(parts) != 2 or not parts[0] or not parts[1]:
+            self.malformed_records += 1
+            return
+
+        host_id, invocation_id = parts
+        self.host_counts[host_id] = self.host_counts.get(host_id, 0) + 1
+        if self.approximate:
+            self._invocation_sketch.add(invocation_id)
+        else:
+            self._invocation_ids.add(invocation_id)
+
+    # Combine the counts of another ledger (e.g. another shard of the same window)
+    def merge(self, other: "LedgerStats") -> None:
+        for host_id, count in other.host_counts.items():
+            self.host_counts[host_id] = self.host_counts.get(host_id, 0) + count
+        self.malformed_records += other.malformed_records
+        self._invocation_ids.update(other._invocation_ids)
+        self._invocation_sketch.merge(other._invocation_sketch)
+
+    @property
+    def host_count(self) -> int:
+        return len(self.host_counts)
+
+    @property
+    def invocation_count(self) -> int:
+        if self.approximate:
+            return self._invocation_sketch.count()
+        return len(self._invocation_ids)
+
+async def read_ledger(downloader: "StorageStreamDownloader", approximate: bool = False) -> LedgerStats:
+    stats = LedgerStats(approximate)
+    async for chunk in downloader.chunks():
+        stats.feed(chunk)
+    stats.finish()
+    return stats
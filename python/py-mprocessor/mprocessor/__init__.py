@@ -1,15 +1,64 @@
 import logging
 import os
 import json
-import requests
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 import azure.functions as func
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
+
+from .clients import get_container_client
+from .codec import decode
+from .instrumentation import maybe_emit_summary, record, span
+from .ledger_writer import get_ledger_writer, ledger_blob_name
+from .metrics_provider import get_metrics_provider
+
+# Do the work for one job and record it in the ledger under ledger_id
+def process_job(job: Dict, ledger_id: str, host_id: str, connection_string: str) -> None:
+    metrics_provider = get_metrics_provider()
+    with span("MetricsFetch"):
+        os_web_response = metrics_provider.get()
+    logging.debug(f"Received the OS Info of size: {len(os_web_response)}")
+
+    # Update status to upend blob, coalesced with other records by the write-behind buffer
+    blob_client = get_container_client(connection_string, "checks").get_blob_client(ledger_blob_name(job["JobName"], host_id))
+    get_ledger_writer().append(blob_client, f"{host_id}:{ledger_id};")
+
+# Shared pool for the jobs of multi-job envelopes, created on first use
+_envelope_executor: Optional[ThreadPoolExecutor] = None
+_envelope_executor_lock = threading.Lock()
+
+# Process the jobs of a multi-job envelope concurrently, returning the ids of failed jobs
+def process_envelope(jobs: List[Dict], invocation_id: str, host_id: str, connection_string: str) -> List:
+    global _envelope_executor
+    if _envelope_executor is None:
+        with _envelope_executor_lock:
+            if _envelope_executor is None:
+                _envelope_executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get("EnvelopeConcurrency", "16")),
+                    thread_name_prefix="mprocessor-job")
+
+    # Each job gets its own ledger id so the scheduler still counts jobs, not invocations
+    futures = [
+        _envelope_executor.submit(process_job, job, f"{invocation_id}.{job['JobId']}", host_id, connection_string)
+        for job in jobs
+    ]
+    failed = []
+    for job, future in zip(jobs, futures):
+        try:
+            future.result()
+        except Exception as ex:
+            logging.error(f"Job {job['JobId']} failed: {ex}")
+            failed.append(job["JobId"])
+    return failed
 
 def main(msg: func.QueueMessage, context: func.Context) -> None:
 
-    start_time = datetime.utcnow()        
+    start_time = datetime.utcnow()
+    start_counter = time.perf_counter()
     status = {
         "StartTime": start_time.strftime("%Y-%m-%d %H:%M:%S%z"),
         "TriggerType": "MessageProcessor",
@@ -17,37 +66,41 @@ def main(msg: func.QueueMessage, context: func.Context) -> None:
     }
 
     try:
-        msg_content = msg.get_body().decode('utf-8')
-        logging.info('Python queue trigger function processed a queue item: %s', msg_content)
-        msg = json.loads(msg_content)
+        with span("MessageDecode"):
+            msg_content = msg.get_body().decode('utf-8')
+            jobs = decode(msg_content)
+        logging.debug('Python queue trigger function processed a queue item: %s', msg_content)
         status["TriggerData"] = msg_content
-        blob_name = msg["JobName"]
 
         # Create a queue client using connection string
         connection_string = os.environ["AzureWebJobsStorage"]
         host_id = os.environ["WEBSITE_INSTANCE_ID"]
 
         # Do work here
-        request_start_time = datetime.utcnow()
-        os_provider_url = "https://veshivanpyfuncsa01.z13.web.core.windows.net/metrics.html"
-        os_web_response = requests.get(os_provider_url).text
-        request_duration = datetime.utcnow() - request_start_time
-        logging.info(f"Received the OS Info of size: {len(os_web_response)}, call duration: {request_duration.microseconds}ms")
-
-        # Update status to upend blob
-        blob_service_client = BlobServiceClient.from_connection_string(conn_str=connection_string)
-        blob_client = blob_service_client.get_blob_client(container="checks", blob=blob_name)
-        if blob_client.exists():
-            logging.info(f"Blob {blob_name} exists")
-            blob_client.append_block(f"{host_id}:{context.invocation_id};")
+        if len(jobs) == 1:
+            process_job(jobs[0], context.invocation_id, host_id, connection_string)
         else:
-            logging.info(f"Blob {blob_name} does not exist")
+            failed_jobs = process_envelope(jobs, context.invocation_id, host_id, connection_string)
+            status["JobCount"] = len(jobs)
+            status["FailedJobs"] = failed_jobs
+            if failed_jobs:
+                status["Status"] = "Failed"
+
+        status["MetricsCache"] = get_metrics_provider().stats()
 
     except Exception as ex:
         logging.exception(f'Exception: {ex}')
         status["Status"] = "Failed"
     finally:
-        end_time = datetime.utcnow()
-        status["EndTime"] = end_time.strftime("%Y-%m-%d %H:%M:%S%z")
-        status["DurationInSec"] = f"{(end_time - start_time).total_seconds()}"
-        logging.info(json.dumps(status))
+        duration = time.perf_counter() - start_counter
+        record("Invocation", duration * 1000)
+        status["EndTime"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S%z")
+        status["DurationInSec"] = f"{duration}"
+
+        # Per-message status is only logged at info level on failure; timings
+        # are reported through the periodic instrumentation summary instead
+        if status["Status"] == "Succeeded":
+            logging.debug(json.dumps(status))
+        else:
+            logging.info(json.dumps(status))
+        maybe_emit_summary("MessageProcessor")
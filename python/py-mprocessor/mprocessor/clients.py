@@ -0,0 +1,71 @@
+import atexit
+import logging
+import threading
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+# The SDK and HTTP client modules are imported on first use rather than at
+# module load, so a cold start does not pay for them before the first message
+if TYPE_CHECKING:
+    import requests
+    from azure.storage.blob import BlobServiceClient, ContainerClient
+
+# Clients shared by every invocation in this worker process. They are created
+# on first use and reused so each message does not pay for new TCP/TLS
+# handshakes and client construction.
+_lock = threading.Lock()
+_http_session: Optional["requests.Session"] = None
+_blob_service_clients: Dict[str, "BlobServiceClient"] = {}
+_container_clients: Dict[Tuple[str, str], "ContainerClient"] = {}
+
+def get_http_session() -> "requests.Session":
+    import requests
+
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                _http_session = requests.Session()
+    return _http_session
+
+def get_blob_service_client(connection_string: str) -> "BlobServiceClient":
+    from azure.storage.blob import BlobServiceClient
+
+    client = _blob_service_clients.get(connection_string)
+    if client is None:
+        with _lock:
+            client = _blob_service_clients.get(connection_string)
+            if client is None:
+                client = BlobServiceClient.from_connection_string(conn_str=connection_string)
+                _blob_service_clients[connection_string] = client
+    return client
+
+def get_container_client(connection_string: str, container: str) -> "ContainerClient":
+    key = (connection_string, container)
+    client = _container_clients.get(key)
+    if client is None:
+        # Container clients share the pipeline (and connection pool) of the service client
+        service_client = get_blob_service_client(connection_string)
+        with _lock:
+            client = _container_clients.get(key)
+            if client is None:
+                client = service_client.get_container_client(container)
+                _container_clients[key] = client
+    return client
+
+def close_clients() -> None:
+    global _http_session
+    with _lock:
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+        _container_clients.clear()
+        for client in _blob_service_clients.values():
+            try:
+                client.close()
+            except Exception as ex:
+                logging.warning(f"Error closing blob service client: {ex}")
+        _blob_service_clients.clear()
+
+atexit.register(close_clients)
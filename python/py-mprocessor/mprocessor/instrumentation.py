@@ -0,0 +1,95 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open ended
+BUCKET_BOUNDS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+# Fixed-size latency histogram. Recording is O(log buckets) with no allocation,
+# so it is cheap enough for the per-message hot path.
+class Histogram:
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float) -> None:
+        self.counts[bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.min_ms = min(self.min_ms, elapsed_ms)
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, pct: float) -> float:
+        # Reported as the upper bound of the bucket holding the percentile (capped at max)
+        target = pct / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target and bucket_count > 0:
+                return min(BUCKET_BOUNDS_MS[index], self.max_ms) if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "Count": self.count,
+            "AvgMs": round(self.total_ms / self.count, 3),
+            "MinMs": round(self.min_ms, 3),
+            "P50Ms": round(self.percentile(50), 3),
+            "P95Ms": round(self.percentile(95), 3),
+            "P99Ms": round(self.percentile(99), 3),
+            "MaxMs": round(self.max_ms, 3),
+        }
+
+_lock = threading.Lock()
+_histograms: Dict[str, Histogram] = {}
+_window_start = time.monotonic()
+_summary_interval_sec = float(os.environ.get("InstrumentationSummaryIntervalSec", "60"))
+_trigger_type = "Function"
+
+def record(name: str, elapsed_ms: float) -> None:
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.record(elapsed_ms)
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+# Log one aggregated summary of all phases recorded since the last one, at most
+# once per InstrumentationSummaryIntervalSec. Called at the end of invocations,
+# so no background thread is needed.
+def maybe_emit_summary(trigger_type: str, force: bool = False) -> None:
+    global _histograms, _window_start, _trigger_type
+    now = time.monotonic()
+    with _lock:
+        _trigger_type = trigger_type
+        if not _histograms or (not force and now - _window_start < _summary_interval_sec):
+            return
+        histograms, _histograms = _histograms, {}
+        window_sec, _window_start = now - _window_start, now
+
+    summary = {
+        "TriggerType": f"{trigger_type}Summary",
+        "WindowSec": round(window_sec, 3),
+        "Phases": {name: histogram.summary() for name, histogram in histograms.items()},
+    }
+    logging.critical(json.dumps(summary))
+
+# Flush whatever was recorded since the last summary when the worker exits
+atexit.register(lambda: maybe_emit_summary(_trigger_type, force=True))
@@ -0,0 +1,132 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import zlib
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from .instrumentation import span
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient
+
+# Write-behind buffer for the append blob ledger.
+#
+# Instead of one append_block call per processed message, "host:invocation;"
+# records are coalesced per target blob and written as a single block once the
+# buffer for that blob reaches LedgerFlushMaxRecords records, LedgerFlushMaxBytes
+# bytes, or its oldest record is LedgerFlushMaxAgeSec seconds old.
+#
+# Durability: a record is buffered in memory when the invocation returns, so
+# the queue message is already completed before the record is persisted. If
+# the worker process dies, up to one buffer per blob is lost and the scheduler
+# will under-count processed messages for that window. Buffers are flushed on
+# normal process exit. LedgerFlushMaxRecords=1 restores write-through behaviour.
+
+# Name of the ledger blob this host appends to. Hosts are spread over
+# LedgerShardCount shard blobs by crc32(host id), so the setting must match the
+# scheduler's; a single shard keeps the unsharded blob name.
+def ledger_blob_name(job_name: str, host_id: str) -> str:
+    shard_count = int(os.environ.get("LedgerShardCount", "1"))
+    if shard_count <= 1:
+        return job_name
+    return f"{job_name}-{zlib.crc32(host_id.encode('utf-8')) % shard_count}"
+
+class _PendingBlob:
+    def __init__(self, blob_client: "BlobClient") -> None:
+        self.blob_client = blob_client
+        self.records: List[str] = []
+        self.size = 0
+        self.first_added = time.monotonic()
+
+class LedgerWriter:
+    def __init__(self, max_records: int, max_bytes: int, max_age_sec: float, optimistic: bool = True) -> None:
+        self.max_records = max(1, max_records)
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.optimistic = optimistic
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _PendingBlob] = {}
+        self._stopped = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    def append(self, blob_client: "BlobClient", record: str) -> None:
+        with self._lock:
+            pending = self._pending.get(blob_client.url)
+            if pending is None:
+                pending = _PendingBlob(blob_client)
+                self._pending[blob_client.url] = pending
+            pending.records.append(record)
+            pending.size += len(record)
+
+            ready = None
+            if len(pending.records) >= self.max_records or pending.size >= self.max_bytes:
+                ready = self._pending.pop(blob_client.url)
+            elif self._timer is None:
+                self._start_timer()
+
+        if ready is not None:
+            self._write(ready)
+
+    def flush(self, max_age_sec: float = 0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, pending in self._pending.items() if now - pending.first_added >= max_age_sec]
+            ready = [self._pending.pop(key) for key in due]
+        for pending in ready:
+            self._write(pending)
+
+    def close(self) -> None:
+        self._stopped.set()
+        self.flush()
+
+    def _start_timer(self) -> None:
+        # Background thread that flushes buffers once they reach max_age_sec
+        self._timer = threading.Thread(target=self._run_timer, name="ledger-writer", daemon=True)
+        self._timer.start()
+
+    def _run_timer(self) -> None:
+        interval = max(self.max_age_sec / 2, 0.05)
+        while not self._stopped.wait(interval):
+            try:
+                self.flush(self.max_age_sec)
+            except Exception as ex:
+                logging.exception(f"Error flushing ledger buffer: {ex}")
+
+    def _write(self, pending: _PendingBlob) -> None:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob_client = pending.blob_client
+        if not self.optimistic:
+            with span("BlobExists"):
+                exists = blob_client.exists()
+            if not exists:
+                logging.info(f"Blob {blob_client.blob_name} does not exist, dropped {len(pending.records)} record(s)")
+                return
+
+        # Optimistic mode appends directly and relies on the not-found error
+        # instead of a pre-check, so a flush costs a single storage call
+        try:
+            with span("BlobAppend"):
+                blob_client.append_block("".join(pending.records))
+            logging.info(f"Appended {len(pending.records)} record(s) to blob {blob_client.blob_name}")
+        except ResourceNotFoundError:
+            logging.info(f"Blob {blob_client.blob_name} does not exist, dropped {len(pending.records)} record(s)")
+
+_writer: Optional[LedgerWriter] = None
+_writer_lock = threading.Lock()
+
+def get_ledger_writer() -> LedgerWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LedgerWriter(
+                    int(os.environ.get("LedgerFlushMaxRecords", "32")),
+                    int(os.environ.get("LedgerFlushMaxBytes", str(64 * 1024))),
+                    float(os.environ.get("LedgerFlushMaxAgeSec", "1")),
+                    os.environ.get("OptimisticStorageOps", "true").lower() == "true")
+                atexit.register(_writer.close)
+    return _writer
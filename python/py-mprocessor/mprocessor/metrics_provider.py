@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from typing import Dict, Optional
+
+from .clients import get_http_session
+
+DEFAULT_OS_PROVIDER_URL = "https://veshivanpyfuncsa01.z13.web.core.windows.net/metrics.html"
+
+class _CacheEntry:
+    def __init__(self, text: str, etag: Optional[str], last_modified: Optional[str], ttl_sec: float) -> None:
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = time.monotonic() + ttl_sec
+
+# Caches the OS metrics page for MetricsCacheTtlSec seconds. Once stale it is
+# revalidated with If-None-Match/If-Modified-Since, so an unchanged page costs
+# a 304 instead of a full download. Only one thread fetches at a time; threads
+# that arrive while a fetch is in flight wait for it and share its result.
+class MetricsProvider:
+    def __init__(self, url: str, ttl_sec: float) -> None:
+        self.url = url
+        self.ttl_sec = ttl_sec
+        self._entry: Optional[_CacheEntry] = None
+        self._fetch_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"Hits": 0, "Misses": 0, "Revalidated": 0, "Coalesced": 0}
+
+    def get(self) -> str:
+        entry = self._entry
+        if entry is not None and time.monotonic() < entry.expires_at:
+            self._count("Hits")
+            return entry.text
+
+        if not self._fetch_lock.acquire(blocking=False):
+            # Another thread is fetching; wait for it and use its result
+            self._count("Coalesced")
+            with self._fetch_lock:
+                pass
+            entry = self._entry
+            if entry is not None:
+                return entry.text
+            self._fetch_lock.acquire()
+
+        try:
+            entry = self._entry
+            if entry is not None and time.monotonic() < entry.expires_at:
+                self._count("Hits")
+                return entry.text
+            self._count("Misses")
+            return self._fetch(entry).text
+        finally:
+            self._fetch_lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _fetch(self, entry: Optional[_CacheEntry]) -> _CacheEntry:
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = get_http_session().get(self.url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self._count("Revalidated")
+            entry.expires_at = time.monotonic() + self.ttl_sec
+            return entry
+
+        response.raise_for_status()
+        entry = _CacheEntry(
+            response.text,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            self.ttl_sec)
+        self._entry = entry
+        return entry
+
+_provider: Optional[MetricsProvider] = None
+_provider_lock = threading.Lock()
+
+def get_metrics_provider() -> MetricsProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = MetricsProvider(
+                    os.environ.get("OSProviderUrl", DEFAULT_OS_PROVIDER_URL),
+                    float(os.environ.get("MetricsCacheTtlSec", "5")))
+    return _provider
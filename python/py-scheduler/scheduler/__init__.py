@@ -1,66 +1,153 @@
 import logging
 import os
+import time
 import azure.functions as func
 import json
 
-from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
-from azure.storage.queue import QueueClient
-from azure.core.exceptions import ResourceExistsError
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-# Setup the append blob
-def setup_append_blob(connection_string: str, append_blob_name: str, start_time: datetime) -> None:
-    
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    container_client = blob_service_client.get_container_client("checks")
+from .codec import encode_jobs
+from .dispatch import create_queue_client, send_messages
+from .instrumentation import maybe_emit_summary, span
+from .ledger import LEDGER_CHUNK_SIZE, is_window_blob, read_ledger, shard_blob_names
+
+# The Azure SDK is imported on first use rather than at module load, so a cold
+# start does not pay for it before the first invocation needs it
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient, ContainerClient, StorageStreamDownloader
+
+# Resources known to exist, so later ticks in this worker process can skip the
+# create calls. With OptimisticStorageOps=false every tick pre-checks as before.
+_provisioned = set()
+
+def optimistic_storage_ops() -> bool:
+    return os.environ.get("OptimisticStorageOps", "true").lower() == "true"
 
+def ensure_container(container_client: "ContainerClient", optimistic: bool) -> None:
+    from azure.core.exceptions import ResourceExistsError
+
+    key = f"{container_client.account_name}/containers/{container_client.container_name}"
+    if optimistic and key in _provisioned:
+        return
     try:
         container_client.create_container()
     except ResourceExistsError:
         logging.info('Container exist.')
+    _provisioned.add(key)
+
+# Log the merged stats of a ledger window from the properties and streamed
+# content of its shard blobs, which are parsed in parallel threads
+def process_append_blob(append_blob_name: str, shards: List["StorageStreamDownloader"]) -> None:
+    blob_stats = {
+        "AppendBlobName": append_blob_name,
+        "ShardCount": len(shards),
+        "BlockCount": sum(shard.properties.append_blob_committed_block_count or 0 for shard in shards),
+    }
+
+    try:
+        shard_properties = [shard.properties for shard in shards]
+        blob_stats["LastSchedulerStartTime"] = shard_properties[0].metadata["TriggerData"]
+        blob_stats["BlobLastModifiedTime"] = f"{max(p.last_modified for p in shard_properties)}"
+        blob_stats["BlobCreationTime"] = f"{min(p.creation_time for p in shard_properties)}"
+
+        approximate = os.environ.get("LedgerApproximateCounts", "false").lower() == "true"
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            shard_stats = list(executor.map(lambda shard: read_ledger(shard, approximate), shards))
+        ledger_stats = shard_stats[0]
+        for stats in shard_stats[1:]:
+            ledger_stats.merge(stats)
+
+        blob_stats["ProcessedMessageCount"] = ledger_stats.invocation_count
+        blob_stats["HostCount"] = ledger_stats.host_count
+        blob_stats["HostMessageCounts"] = ledger_stats.host_counts
+        blob_stats["MalformedRecordCount"] = ledger_stats.malformed_records
+        blob_stats["ApproximateCounts"] = approximate
+
+        logging.critical(json.dumps(blob_stats))
+    except Exception as ex:
+        logging.exception(f"Exception while processing append blob: {ex}")
+
+# Start downloading one shard found by listing the window. The download
+# response carries the properties and metadata, so no exists() call is needed;
+# a shard deleted since the listing is skipped
+def download_shard(blob_client: "BlobClient") -> Optional["StorageStreamDownloader"]:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        return blob_client.download_blob()
+    except ResourceNotFoundError:
+        return None
+
+def create_shard(container_client: "ContainerClient", blob_client: "BlobClient", metadata: Dict[str, str]) -> None:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        blob_client.create_append_blob(metadata=metadata)
+    except ResourceNotFoundError:
+        # The container was removed since it was provisioned; create it and retry
+        _provisioned.clear()
+        ensure_container(container_client, False)
+        blob_client.create_append_blob(metadata=metadata)
+
+def delete_shard(container_client: "ContainerClient", name: str) -> None:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        container_client.delete_blob(name)
+    except ResourceNotFoundError:
+        pass
 
-    append_blob_client = container_client.get_blob_client(append_blob_name)
-    if append_blob_client.exists():
-        blob_properties = append_blob_client.get_blob_properties()
-        
-        blob_stats = {
-            "AppendBlobName": append_blob_name,
-            "BlockCount": blob_properties.append_blob_committed_block_count,
-        }
-
-        try:
-            blob_stats["LastSchedulerStartTime"] = blob_properties.metadata["TriggerData"]
-            blob_stats["BlobLastModifiedTime"] = f"{blob_properties.last_modified}"
-            blob_stats["BlobCreationTime"] = f"{blob_properties.creation_time}"
-            
-            blob_content = append_blob_client.download_blob().content_as_text()
-            host_ids = set()
-            invocation_ids = set()
-
-            if (blob_content is not None) and len(blob_content) > 0:
-                for entry in blob_content.split(';'):
-                    if entry.find(':') > 0:
-                        key, value = entry.split(':')
-                        host_ids.add(key)
-                        invocation_ids.add(value)
-
-            blob_stats["ProcessedMessageCount"] = len(invocation_ids)
-            blob_stats["HostCount"] = len(host_ids)
-
-            logging.critical(json.dumps(blob_stats))
-
-            append_blob_client.delete_blob()
-        except Exception as ex:
-            logging.exception(f"Exception while processing append blob: {ex}")
+# Setup the append blob
+def setup_append_blob(connection_string: str, append_blob_name: str, start_time: datetime) -> None:
+    from azure.storage.blob import BlobServiceClient
+
+    # Download the ledger in bounded ranges so it is never held in memory as a whole
+    blob_service_client = BlobServiceClient.from_connection_string(
+        connection_string,
+        max_single_get_size=LEDGER_CHUNK_SIZE,
+        max_chunk_get_size=LEDGER_CHUNK_SIZE)
+    container_client = blob_service_client.get_container_client("checks")
+
+    optimistic = optimistic_storage_ops()
+    ensure_container(container_client, optimistic)
+
+    # Discover the blobs actually written for this window with one listing,
+    # whatever the shard count was when they were created. Shards outside the
+    # current layout (e.g. after LedgerShardCount changed) are still merged
+    # below and then deleted.
+    shard_names = shard_blob_names(append_blob_name, int(os.environ.get("LedgerShardCount", "1")))
+    existing_names = [
+        blob.name for blob in container_client.list_blobs(name_starts_with=append_blob_name)
+        if is_window_blob(append_blob_name, blob.name)
+    ]
+
+    with ThreadPoolExecutor(max_workers=len(existing_names) or 1) as executor:
+        downloads = list(executor.map(
+            lambda name: download_shard(container_client.get_blob_client(name)), existing_names))
+    shards = [shard for shard in downloads if shard is not None]
+    if shards:
+        process_append_blob(append_blob_name, shards)
+    else:
+        logging.info(f"Blob {append_blob_name} does not exist.")
+
+    # Creating an append blob replaces any existing blob of the same name, so the
+    # optimistic path only deletes shards that are not created again
+    stale_names = [shard.name for shard in shards if not optimistic or shard.name not in shard_names]
+    for name in stale_names:
+        delete_shard(container_client, name)
 
     metadata = {
         "TriggerData": start_time.strftime("%Y-%m-%d %H:%M:%S%z")
     }
-    append_blob_client.create_append_blob(metadata=metadata)
+    with ThreadPoolExecutor(max_workers=len(shard_names)) as executor:
+        list(executor.map(
+            lambda name: create_shard(container_client, container_client.get_blob_client(name), metadata), shard_names))
 
 def main(mytimer: func.TimerRequest, context: func.Context) -> None:
     start_time = datetime.utcnow()
+    start_counter = time.perf_counter()
     if mytimer.past_due:
         logging.info('The timer is past due!')
 
@@ -72,42 +159,58 @@ def main(mytimer: func.TimerRequest, context: func.Context) -> None:
         "Status": "Succeeded"
     }
     iMsg = 0
+    iFailed = 0
 
     try:
+        from azure.core.exceptions import ResourceExistsError
+
         # Create a queue client using connection string
         connection_string = os.environ["AzureWebJobsStorage"]
 
         # Setup the append blob
         blob_name = f"ApendBlob_{int(start_time.second / 20)}"
-        setup_append_blob(connection_string, blob_name, start_time)
-
-        queue_client = QueueClient.from_connection_string(connection_string, "checks")
-                
-        try:
-            # Create the queue
-            queue_client.create_queue()
-        except ResourceExistsError:
-            logging.info('Queue exist.')
+        with span("LedgerSetup"):
+            setup_append_blob(connection_string, blob_name, start_time)
 
-        # Send messages to the queue
+        # Encode all messages up front so the send workers only do I/O
         max_messages = int(os.environ["MessageCount"])
-        for i in range(max_messages):
-            msgObj = {
-                "InsertTimeUtc": datetime.utcnow(),
-                "JobName": blob_name,
-                "InvocationId": context.invocation_id,
-                "JobId": i
-            }
-            message = b64encode(json.dumps(msgObj, sort_keys=True, default=str).encode('utf-8')).decode('ascii')
-            queue_client.send_message(message)
-            iMsg += 1
-            
+        with span("MessageEncode"):
+            # JobsPerEnvelope > 1 packs several jobs into each queue message
+            jobs_per_envelope = int(os.environ.get("JobsPerEnvelope", "1"))
+            messages = encode_jobs(blob_name, context.invocation_id, range(max_messages), jobs_per_envelope)
+
+        # Send messages to the queue, in parallel when SendWorkers > 1
+        workers = int(os.environ.get("SendWorkers", "1"))
+        max_retries = int(os.environ.get("SendMaxRetries", "3"))
+        backoff_sec = float(os.environ.get("SendRetryBackoffSec", "0.5"))
+        with create_queue_client(connection_string, "checks", workers) as queue_client:
+            queue_key = f"{queue_client.account_name}/queues/{queue_client.queue_name}"
+            if not optimistic_storage_ops() or queue_key not in _provisioned:
+                try:
+                    # Create the queue
+                    queue_client.create_queue()
+                except ResourceExistsError:
+                    logging.info('Queue exist.')
+                _provisioned.add(queue_key)
+
+            result = send_messages(queue_client, messages, workers, max_retries, backoff_sec)
+
+        iMsg = result.succeeded_jobs
+        iFailed = result.failed_jobs
+        status["QueueMessages"] = f"{result.succeeded}"
+        status["SendWorkers"] = f"{workers}"
+        status["RetriedSends"] = f"{result.retried}"
+        if iFailed > 0:
+            status["Status"] = "Failed"
+            # The queue may have been removed; provision it again on the next tick
+            _provisioned.discard(queue_key)
     except Exception as ex:
         logging.exception(f"Error sending message to queue: {ex}")
         status["Status"] = "Failed"
     finally:
-        end_time = datetime.utcnow()
-        status["EndTime"] = end_time.strftime("%Y-%m-%d %H:%M:%S%z")
-        status["DurationInSec"] = f"{(end_time - start_time).total_seconds()}"
+        status["EndTime"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S%z")
+        status["DurationInSec"] = f"{time.perf_counter() - start_counter}"
         status["ScheduledMessages"] = f"{iMsg}"
-        logging.critical(json.dumps(status))
\ No newline at end of file
+        status["FailedMessages"] = f"{iFailed}"
+        logging.critical(json.dumps(status))
+        maybe_emit_summary("Scheduler")
\ No newline at end of file
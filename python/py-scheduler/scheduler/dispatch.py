@@ -0,0 +1,144 @@
+import logging
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable, Tuple
+
+from .instrumentation import span
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+# Status codes the queue service uses when it is throttling or briefly unavailable
+RETRYABLE_STATUS_CODES = {408, 429, 500, 503}
+
+# Connections the SDK's requests transport keeps per host by default
+DEFAULT_POOL_SIZE = 10
+
+# Send results shared by all worker threads, guarded by a lock. Messages may
+# carry several jobs, so jobs are counted separately from queue messages.
+class DispatchResult:
+    def __init__(self) -> None:
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.succeeded_jobs = 0
+        self.failed_jobs = 0
+        self._lock = threading.Lock()
+
+    def record(self, succeeded: bool, retries: int, job_count: int) -> None:
+        with self._lock:
+            if succeeded:
+                self.succeeded += 1
+                self.succeeded_jobs += job_count
+            else:
+                self.failed += 1
+                self.failed_jobs += job_count
+            self.retried += retries
+
+# Queue client for `workers` concurrent senders. The connection pool is sized
+# to the worker count, since a smaller pool makes threads discard and reopen
+# connections. SDK retries are disabled so SendMaxRetries/SendRetryBackoffSec
+# are the only retry policy for sends, and every retry is counted.
+def create_queue_client(connection_string: str, queue_name: str, workers: int) -> "QueueClient":
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+    from azure.storage.queue import QueueClient
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(workers, DEFAULT_POOL_SIZE))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return QueueClient.from_connection_string(
+        connection_string, queue_name, retry_total=0, transport=RequestsTransport(session=session, session_owner=True))
+
+# Recreates the queue for the sends of one tick when they find it missing,
+# e.g. because it was deleted after being cached as provisioned. Only the first
+# sender to see the 404 creates it; the others wait and then retry.
+class QueueRecreator:
+    def __init__(self, queue_client: "QueueClient") -> None:
+        self.queue_client = queue_client
+        self._lock = threading.Lock()
+        self._recreated = False
+
+    def recreate(self) -> None:
+        from azure.core.exceptions import ResourceExistsError
+
+        with self._lock:
+            if self._recreated:
+                return
+            self._recreated = True
+            try:
+                self.queue_client.create_queue()
+                logging.warning(f"Queue {self.queue_client.queue_name} was missing and has been recreated")
+            except ResourceExistsError:
+                pass
+            except Exception as ex:
+                logging.warning(f"Could not recreate queue {self.queue_client.queue_name}: {ex}")
+
+def is_retryable(ex: Exception) -> bool:
+    from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+    if isinstance(ex, (ServiceRequestError, ServiceResponseError)):
+        return True
+    return isinstance(ex, HttpResponseError) and ex.status_code in RETRYABLE_STATUS_CODES
+
+# Send one message, backing off exponentially (with jitter) on throttling. A
+# missing queue is recreated once and the send retried straight away.
+def send_with_retry(queue_client: "QueueClient", message: str, job_count: int, max_retries: int,
+                    backoff_sec: float, result: DispatchResult, recreator: QueueRecreator) -> None:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    attempt = 0
+    recreated = False
+    while True:
+        try:
+            with span("QueueSend"):
+                queue_client.send_message(message)
+            result.record(True, attempt, job_count)
+            return
+        except Exception as ex:
+            if isinstance(ex, ResourceNotFoundError) and not recreated:
+                recreated = True
+                recreator.recreate()
+                continue
+            if attempt >= max_retries or not is_retryable(ex):
+                logging.warning(f"Failed to send message after {attempt + 1} attempt(s): {ex}")
+                result.record(False, attempt, job_count)
+                return
+            delay = backoff_sec * (2 ** attempt)
+            attempt += 1
+            time.sleep(delay + random.uniform(0, delay))
+
+# Send all (message, job count) pairs, one by one when `workers` is 1, otherwise spread over a
+# bounded thread pool. The queue client is shared; the SDK clients are safe
+# to use from multiple threads.
+def send_messages(queue_client: "QueueClient", messages: Iterable[Tuple[str, int]], workers: int,
+                  max_retries: int, backoff_sec: float) -> DispatchResult:
+    result = DispatchResult()
+    recreator = QueueRecreator(queue_client)
+
+    if workers <= 1:
+        for message, job_count in messages:
+            send_with_retry(queue_client, message, job_count, max_retries, backoff_sec, result, recreator)
+        return result
+
+    pending = iter(messages)
+    pending_lock = threading.Lock()
+
+    def worker() -> None:
+        while True:
+            with pending_lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            send_with_retry(queue_client, item[0], item[1], max_retries, backoff_sec, result, recreator)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler-send") as executor:
+        futures = [executor.submit(worker) for _ in range(workers)]
+        for future in futures:
+            future.result()
+
+    return result